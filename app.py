@@ -1,12 +1,15 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 import joblib
-import pandas as pd
-import re
+import cachetools
+import numpy as np
+import orjson
 import stripe
 import os
 import logging
+import threading
+from urllib.parse import urlsplit
 
 # ✅ Initialize Flask App
 app = Flask(__name__)
@@ -17,23 +20,45 @@ CORS(app, resources={
     }
 })
 # ✅ Logging Configuration
-logging.basicConfig(level=logging.INFO)
+# WARNING by default keeps per-request logging off the hot path; LOG_LEVEL=INFO shows startup progress
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'WARNING').upper())
 logger = logging.getLogger(__name__)
 logger.info("🚀 Starting the URL Scam Detector Backend...")
 
 # ✅ Database Configuration
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///users.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Database servers drop idle connections; ping on checkout instead of failing the next auth lookup.
+# SQLite has no server to do that, so it skips the extra query. The default pool size already
+# covers each worker's threads.
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
 db = SQLAlchemy(app)
 
+# ✅ Request Size Limit (larger bodies are rejected with 413 before any parsing)
+app.config['MAX_CONTENT_LENGTH'] = 64_000
+
+# ✅ Fast JSON Responses (orjson encodes in C instead of the stdlib json module)
+def json_response(payload, status=200):
+    return Response(orjson.dumps(payload), status=status, mimetype='application/json')
+
+# Oversized bodies get the same JSON error shape as every other rejection
+@app.errorhandler(413)
+def request_too_large(error):
+    return json_response({"error": f"Request body exceeds {app.config['MAX_CONTENT_LENGTH']} bytes."}, 413)
+
 # ✅ Stripe Configuration
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY', 'your_stripe_secret_key')
 publishable_key = os.getenv('STRIPE_PUBLISHABLE_KEY')
-print("STRIPE_SECRET_KEY:", stripe.api_key)
-print("STRIPE_PUBLISHABLE_KEY:", os.getenv('STRIPE_PUBLISHABLE_KEY'))
+logger.debug("Stripe secret key configured: %s", 'STRIPE_SECRET_KEY' in os.environ)
+logger.debug("Stripe publishable key: %s", publishable_key)
 # ✅ Load the Trained Model
 model_path = os.path.join(os.path.dirname(__file__), 'optimized_random_forest_model.pkl')
+# Column order the model was trained on; analyze_url returns FEATURE_ORDER[1:] and
+# get_feature_buffer keeps column 0 (web_traffic) zeroed
+FEATURE_ORDER = ('web_traffic', 'https', 'length_of_url', 'scam_keywords', 'unusual_tlds', 'special_chars')
 
+model = None
 try:
     model = joblib.load(model_path)
     if hasattr(model, 'predict'):
@@ -43,18 +68,71 @@ try:
 except FileNotFoundError:
     logger.error("❌ optimized_random_forest_model.pkl not found. Ensure the file exists.")
 except Exception as e:
+    model = None
     logger.error(f"❌ Error loading model: {str(e)}")
 
+# Rows are fed as plain arrays in FEATURE_ORDER, so a model trained on another column order
+# would mispredict silently: refuse to start instead of serving it
+if model is not None and hasattr(model, 'feature_names_in_'):
+    if tuple(model.feature_names_in_) != FEATURE_ORDER:
+        raise RuntimeError(f"Model was trained on features {tuple(model.feature_names_in_)}, expected {FEATURE_ORDER}.")
+    # Names are checked above, so drop them rather than have sklearn check them on every call
+    del model.feature_names_in_
+
+# ✅ Optional ONNX Runtime Backend (export steps in README.md)
+onnx_model_path = os.path.join(os.path.dirname(__file__), 'optimized_random_forest_model.onnx')
+onnx_session = None
+
+if os.path.exists(onnx_model_path):
+    try:
+        import onnxruntime as ort
+        # One inference thread per session: Gunicorn already runs several workers per CPU
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = 1
+        session_options.inter_op_num_threads = 1
+        onnx_session = ort.InferenceSession(onnx_model_path, sess_options=session_options,
+                                            providers=['CPUExecutionProvider'])
+        onnx_input_name = onnx_session.get_inputs()[0].name
+        logger.info("✅ ONNX model loaded; using ONNX Runtime for inference.")
+    except Exception as e:
+        onnx_session = None
+        logger.error(f"❌ Error loading ONNX model, falling back to scikit-learn: {str(e)}")
+
+def model_predict(features):
+    if onnx_session is not None:
+        X = np.asarray(features, dtype=np.float32)
+        return onnx_session.run(None, {onnx_input_name: X})[0]
+    return model.predict(features)
+
+# ✅ Warm Up the Model so the first request doesn't pay for lazy setup
+try:
+    model_predict(np.zeros((1, len(FEATURE_ORDER)), dtype=np.float32))
+    logger.info("✅ Model warm-up prediction completed.")
+except Exception as e:
+    logger.error(f"❌ Model warm-up failed: {str(e)}")
+
 # ✅ User Model
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
     password = db.Column(db.String(100), nullable=False)
     is_premium = db.Column(db.Boolean, default=False)
-    api_key = db.Column(db.String(100), unique=True)
+    api_key = db.Column(db.String(100), unique=True, index=True, nullable=False)
+
+# Auth only needs two columns, so select them directly instead of loading a User
+API_KEY_LOOKUP = db.select(User.id, User.is_premium).where(User.api_key == db.bindparam('api_key'))
+
+# WAL lets auth reads proceed while a write (e.g. /add-api-key) is in progress
+def enable_sqlite_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
 
 # ✅ Initialize the Database
 with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        db.event.listen(db.engine, 'connect', enable_sqlite_wal)
     db.create_all()
     logger.info("✅ Database initialized.")
 
@@ -68,90 +146,249 @@ TRUSTED_DOMAINS = [
     'facebook.com', 'twitter.com', 'linkedin.com', 'instagram.com',
     'amazon.com', 'ebay.com', 'shopify.com', '.ca' , '.et', '.org', '.edu'
 ]
+# Leading dots only marked "any subdomain of"; suffix probing already covers that
+TRUSTED_DOMAIN_SET = frozenset(d.lstrip('.') for d in TRUSTED_DOMAINS)
 
-# Update is_suspicious function
-def is_suspicious(url):
-    from urllib.parse import urlparse
-    parsed_url = urlparse(url)
-    domain = parsed_url.netloc
-    
-    # Check against trusted domains
-    if any(domain.endswith(trusted) for trusted in TRUSTED_DOMAINS):
-        return False, "Trusted domain detected"
-    
-    # Continue with existing checks
-    HIGH_RISK_KEYWORDS = ['offer', 'free', 'win', 'bonus', 'gift']
-    SUSPICIOUS_TLDS = ['tk', 'ru', 'biz', 'cf', 'xyz']
-    SPECIAL_CHARS = ['$', '%', '&', '?', '-', '_', '!', '=', '@']
-
-    if url.split('.')[-1] in SUSPICIOUS_TLDS:
-        return True, "Suspicious TLD detected"
-    if any(keyword in url.lower() for keyword in HIGH_RISK_KEYWORDS):
-        return True, "High-risk keyword detected"
-    if sum(c in SPECIAL_CHARS for c in url) > 3:
-        return True, "Excessive special characters detected"
-    
-    return False, "No explicit scam patterns detected"
-
-# ✅ Feature Extraction
-def extract_features(url):
-    HIGH_RISK_KEYWORDS = ['offer', 'free', 'win', 'bonus', 'gift']
-    SUSPICIOUS_TLDS = ['tk', 'ru', 'biz', 'cf', 'xyz']
-    SPECIAL_CHARS = ['$', '%', '&', '?', '-', '_', '!', '=', '@']
-
-    scam_keywords = sum(word in url.lower() for word in HIGH_RISK_KEYWORDS)
-    unusual_tlds = 1 if url.split('.')[-1] in SUSPICIOUS_TLDS else 0
-    special_chars = sum(c in SPECIAL_CHARS for c in url)
-    length_of_url = len(url)
-    web_traffic = 0
-
-    return {
-        'web_traffic': web_traffic,
-        'https': 1 if url.startswith('https') else 0,
-        'length_of_url': length_of_url,
-        'scam_keywords': scam_keywords,
-        'unusual_tlds': unusual_tlds,
-        'special_chars': special_chars
-    }
+def is_trusted_domain(domain):
+    # Probe the host and each parent domain: 'a.b.gov' -> 'a.b.gov', 'b.gov', 'gov'
+    while True:
+        if domain in TRUSTED_DOMAIN_SET:
+            return True
+        _, dot, domain = domain.partition('.')
+        if not dot:
+            return False
+
+# Scam Rule Constants (built once, hashed lookups on the request path)
+HIGH_RISK_KEYWORDS = ('offer', 'free', 'win', 'bonus', 'gift')
+SUSPICIOUS_TLDS = frozenset({'tk', 'ru', 'biz', 'cf', 'xyz'})
+SPECIAL_CHARS = frozenset('$%&?-_!=@')
+# byte -> 1 if it is a special char, else 0 (all special chars are ASCII)
+SPECIAL_CHARS_TABLE = bytes(1 if chr(i) in SPECIAL_CHARS else 0 for i in range(256))
+
+def count_special_chars(url):
+    return url.encode('ascii', 'ignore').translate(SPECIAL_CHARS_TABLE).count(b'\x01')
+
+def build_keyword_function(name, keywords, operator):
+    # Unroll the keyword list into one straight-line expression, generated once at startup:
+    # return ('bonus' in url_lower) <operator> ('free' in url_lower) <operator> ...
+    tests = f' {operator} '.join(f'({keyword!r} in url_lower)' for keyword in sorted(keywords)) or '0'
+    namespace = {}
+    exec(f"def {name}(url_lower):\n    return {tests}\n", namespace)
+    return namespace[name]
+
+count_scam_keywords = build_keyword_function('count_scam_keywords', HIGH_RISK_KEYWORDS, '+')
+has_scam_keyword = build_keyword_function('has_scam_keyword', HIGH_RISK_KEYWORDS, 'or')
+
+# Schemes browsers open with or without the '//' ('http:evil.tk' loads http://evil.tk/)
+HOST_SCHEMES = frozenset(('http', 'https', 'ftp', 'ws', 'wss'))
+
+# Lowercased host without a trailing dot; scheme-less input like 'evil.tk/login' is read as a host too
+def get_hostname(url):
+    try:
+        parts = urlsplit(url)
+        if not parts.netloc:
+            if parts.scheme in HOST_SCHEMES:
+                # 'http:evil.tk', 'http:/evil.tk', 'https:\\evil.tk': the host follows the scheme
+                url = url.partition(':')[2].lstrip('/\\')
+            # Otherwise the URL starts with the host: no scheme at all (a '://' later in the query
+            # doesn't count), or a 'host:port' that urlsplit took for a scheme
+            parts = urlsplit('//' + url)
+        hostname = parts.hostname
+    except ValueError:  # e.g. an unbalanced '[' in the host
+        return ''
+    return (hostname or '').rstrip('.')
+
+# ✅ URL Analysis: explicit scam rules and ML features in one pass
+# Returns (suspicious, reason, features): the reason when a rule flags the URL (features None),
+# else reason None and the features for the model
+def analyze_url(url):
+    url_lower = url.lower()
+    hostname = get_hostname(url)
+    # TLD of the host, not whatever follows the last dot of the path ('x.com/a.ru' isn't a .ru site)
+    tld = hostname.rpartition('.')[2]
+
+    if is_trusted_domain(hostname):
+        scam_keywords = count_scam_keywords(url_lower)
+        unusual_tlds = 1 if tld in SUSPICIOUS_TLDS else 0
+        special_chars = count_special_chars(url)
+    else:
+        # Cheapest checks first; each one returns as soon as it fires
+        if tld in SUSPICIOUS_TLDS:
+            return True, "Suspicious TLD detected", None
+        if has_scam_keyword(url_lower):
+            return True, "High-risk keyword detected", None
+        special_chars = count_special_chars(url)
+        if special_chars > 3:
+            return True, "Excessive special characters detected", None
+        # The checks above already ruled out suspicious TLDs and keywords
+        scam_keywords = unusual_tlds = 0
+
+    # Schemes are case-insensitive, so 'HTTPS://' counts too
+    https = 1 if url_lower.startswith('https') else 0
+
+    # FEATURE_ORDER without web_traffic, which is always 0 and stays zeroed in the feature buffer
+    return False, None, (https, len(url), scam_keywords, unusual_tlds, special_chars)
+
+# ✅ Per-Thread Feature Buffer, reused across requests instead of allocated per batch
+_feature_buffers = threading.local()
+
+def get_feature_buffer(n):
+    buf = getattr(_feature_buffers, 'buf', None)
+    if buf is None or buf.shape[0] < n:
+        # float32 is what both backends walk the trees in; narrower ints would just be copied back
+        # Zeroed once: column 0 (web_traffic) is never written, rows only fill columns 1..5
+        buf = np.zeros((max(n, 64), len(FEATURE_ORDER)), dtype=np.float32)
+        _feature_buffers.buf = buf
+    return buf[:n]
+
+# ✅ Verdict Cache (URL -> (prediction, reason)) for both rule and ML outcomes
+# Keys are the URLs themselves, so longer ones aren't cached: that bounds the cache at
+# VERDICT_CACHE_SIZE x MAX_CACHED_URL_LENGTH characters instead of whatever fits in a request body
+VERDICT_CACHE_SIZE = 65536
+MAX_CACHED_URL_LENGTH = 2048
+_verdict_cache = cachetools.LRUCache(maxsize=VERDICT_CACHE_SIZE)
+_verdict_cache_lock = threading.Lock()
+
+def get_cached_verdict(url):
+    with _verdict_cache_lock:
+        return _verdict_cache.get(url)
+
+def cache_verdict(url, verdict):
+    if len(url) > MAX_CACHED_URL_LENGTH:
+        return
+    with _verdict_cache_lock:
+        _verdict_cache[url] = verdict
+
+# ✅ API Key Cache (api_key -> (user_id, is_premium)), refreshed on miss
+_auth_cache = cachetools.TTLCache(maxsize=10000, ttl=60)
+_auth_cache_lock = threading.Lock()
+
+def resolve_api_key(api_key):
+    with _auth_cache_lock:
+        cached = _auth_cache.get(api_key)
+    if cached is None:
+        row = db.session.execute(API_KEY_LOOKUP, {'api_key': api_key}).first()
+        cached = (row.id, row.is_premium) if row else (None, False)
+        with _auth_cache_lock:
+            _auth_cache[api_key] = cached
+    return cached
+
+# Keys of User rows inserted, updated or deleted in a flush are dropped once the transaction
+# commits; dropping them at flush time would let another thread re-cache the old committed row
+@db.event.listens_for(db.session, 'after_flush')
+def collect_stale_api_keys(session, flush_context):
+    stale = session.info.setdefault('stale_api_keys', set())
+    for user in (*session.new, *session.dirty, *session.deleted):
+        if not isinstance(user, User):
+            continue
+        history = db.inspect(user).attrs.api_key.history
+        keys = history.sum()
+        if not keys or (user not in session.new and history.added and not history.deleted):
+            # The (old) key was never loaded, e.g. expired after an earlier commit, so it can't be named
+            stale.add(None)
+        stale.update(keys)
+
+@db.event.listens_for(db.session, 'after_commit')
+def clear_stale_api_keys(session):
+    stale = session.info.pop('stale_api_keys', None)
+    if not stale:
+        return
+    with _auth_cache_lock:
+        if None in stale:
+            _auth_cache.clear()
+        else:
+            for api_key in stale:
+                _auth_cache.pop(api_key, None)
+
+@db.event.listens_for(db.session, 'after_rollback')
+def discard_stale_api_keys(session):
+    session.info.pop('stale_api_keys', None)
+
+# ✅ Predict Payload: a non-empty JSON list of {'url': <string>} objects, else None
+def parse_url_batch(body):
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(data, list) or not data:
+        return None
+    urls = [entry.get('url') if isinstance(entry, dict) else None for entry in data]
+    if not all(isinstance(url, str) for url in urls):
+        return None
+    return urls
 
 # ✅ Predict Endpoint
 @app.route('/predict', methods=['POST'])
 def predict():
+    # Reject malformed payloads before spending a DB lookup on them
+    urls = parse_url_batch(request.get_data())
+    if urls is None:
+        return json_response({"error": "Expected a JSON list of {'url': ...} objects."}, 400)
+
     try:
-        api_key = request.headers.get('Authorization')
-        user = User.query.filter_by(api_key=api_key).first()
+        # Accept a bare key or 'Bearer <key>' (scheme names are case-insensitive);
+        # a missing key is rejected without a lookup
+        authorization = request.headers.get('Authorization', '').strip()
+        scheme, _, credentials = authorization.partition(' ')
+        api_key = credentials.strip() if scheme.lower() == 'bearer' else authorization
+        user_id, is_premium = resolve_api_key(api_key) if api_key else (None, False)
         
-        if not user:
+        if user_id is None:
             logger.warning("❌ Unauthorized access attempt detected.")
-            return jsonify({"error": "Unauthorized: Invalid API Key."}), 401
+            return json_response({"error": "Unauthorized: Invalid API Key."}, 401)
         
-        if not user.is_premium:
+        if not is_premium:
             logger.warning("🔒 Non-premium user attempted advanced features.")
-            return jsonify({"error": "Upgrade to Premium for advanced features."}), 402
+            return json_response({"error": "Upgrade to Premium for advanced features."}, 402)
+
+        # Score each distinct URL once; duplicates are filled in from the same result
+        unique_urls = list(dict.fromkeys(urls))
+
+        # Reuse cached verdicts, then apply the explicit rules; only URLs they don't flag go to the model
+        result_by_url = {}
+        ml_urls = []
+        ml_features = []
+        for url in unique_urls:
+            verdict = get_cached_verdict(url)
+            if verdict is None:
+                suspicious, reason, features = analyze_url(url)
+                if not suspicious:
+                    ml_urls.append(url)
+                    ml_features.append(features)
+                    continue
+                verdict = ("Scam", reason)
+                cache_verdict(url, verdict)
+            prediction, reason = verdict
+            result_by_url[url] = {"url": url, "prediction": prediction, "reason": reason}
 
-        data = request.get_json()
-        url = data[0]['url']
+        # Score every remaining URL with a single vectorized model call
+        if ml_urls:
+            X = get_feature_buffer(len(ml_urls))
+            X[:, 1:] = ml_features
+            preds = model_predict(X)
+            for url, pred in zip(ml_urls, preds):
+                prediction = "Scam" if pred == 1 else "Legitimate"
+                cache_verdict(url, (prediction, "Predicted by ML model"))
+                result_by_url[url] = {"url": url, "prediction": prediction, "reason": "Predicted by ML model"}
 
-        return jsonify({"results": [{"url": url, "prediction": "Legitimate", "reason": "Predicted by ML model"}]})
+        return json_response({"results": [result_by_url[url] for url in urls]})
 
     except Exception as e:
-        logger.error(f"❌ Error in /predict: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("❌ Error in /predict: %s", e)
+        return json_response({"error": str(e)}, 500)
 
 # ✅ Health Check Endpoint
 @app.route('/health', methods=['GET'])
 def health_check():
-    logger.info("✅ Health check endpoint accessed.")
-    return jsonify({
+    return json_response({
         "message": "Server is running successfully.",
-        "usage": "Send a POST request to /predict with a JSON payload containing 'url'."
+        "usage": "Send a POST request to /predict with a JSON list of {'url': ...} objects; all URLs are scored in one batch."
     })
 
 # ✅ Root Route
 @app.route('/', methods=['GET'])
 def root():
-    logger.info("✅ Root route accessed.")
-    return jsonify({
+    return json_response({
         "message": "Welcome to URL Scam Detector Backend!",
         "health_check": "/health"
     })
@@ -176,36 +413,39 @@ def create_checkout_session():
             success_url='https://radiant-selkie-120b55.netlify.app//success',
             cancel_url='https://radiant-selkie-120b55.netlify.app//cancel',
         )
-        return jsonify({'checkout_url': session.url})
+        return json_response({'checkout_url': session.url})
     except stripe.error.StripeError as e:
-        logger.error(f"Stripe error: {e}")
-        return jsonify({'error': str(e)}), 500
+        logger.error("Stripe error: %s", e)
+        return json_response({'error': str(e)}, 500)
 @app.route('/debug-api-keys', methods=['GET'])
 def debug_api_keys():
     try:
-        users = User.query.all()
-        users_data = [{"username": user.username, "api_key": user.api_key, "is_premium": user.is_premium} for user in users]
-        return jsonify({"users": users_data})
+        rows = db.session.execute(db.select(User.username, User.api_key, User.is_premium)).all()
+        users_data = [row._asdict() for row in rows]
+        return json_response({"users": users_data})
     except Exception as e:
-        logger.error(f"❌ Error in /debug-api-keys: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("❌ Error in /debug-api-keys: %s", e)
+        return json_response({"error": str(e)}, 500)
    # ✅ Example of a properly indented add_api_key function
 @app.route('/add-api-key', methods=['POST'])
 def add_api_key():
     try:
         api_key = request.json.get('api_key')
+        if not api_key:
+            return json_response({"error": "Missing api_key."}, 400)
         user = User.query.filter_by(api_key=api_key).first()
         
         if user:
             user.is_premium = True
             db.session.commit()
-            return jsonify({"message": "User upgraded to Premium!"})
+            return json_response({"message": "User upgraded to Premium!"})
         else:
-            return jsonify({"error": "User not found!"}), 404
+            return json_response({"error": "User not found!"}, 404)
     except Exception as e:
-        logger.error(f"❌ Error in /add-api-key: {str(e)}")
-        return jsonify({"error": str(e)}), 500
+        logger.error("❌ Error in /add-api-key: %s", e)
+        return json_response({"error": str(e)}, 500)
 
-# ✅ Run the Server
+# ✅ Run the Server (local development; production runs `gunicorn app:app`, see gunicorn.conf.py)
+# Set FLASK_DEBUG=1 to enable the debugger and reloader
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5002, debug=True)
+    app.run(host='0.0.0.0', port=5002)
@@ -0,0 +1,17 @@
+# ✅ Gunicorn Configuration (picked up automatically by `gunicorn app:app`)
+import os
+
+# Gunicorn's recommended 2 x CPUs + 1; WEB_CONCURRENCY / GUNICORN_THREADS override per host
+workers = int(os.getenv('WEB_CONCURRENCY', 2 * (os.cpu_count() or 1) + 1))
+threads = int(os.getenv('GUNICORN_THREADS', 2))
+worker_class = 'gthread'
+
+# Load the app (and the ML model) once in the master; workers share it via fork copy-on-write
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Each worker opens its own DB connections instead of reusing the master's pool
+    from app import app, db
+    with app.app_context():
+        db.engine.dispose(close=False)